@@ -1,10 +1,193 @@
 import glob
 import json
 import argparse
+import collections
+import multiprocessing
+import os
 import re
+import shutil
+import zipfile
+from functools import lru_cache, partial
 from pathlib import Path
-from odfdo import Document, Style, Span, remove_tree
+from lxml import etree
+from odfdo import Document, Element, Style
 from abc import ABC, abstractmethod
+from collections.abc import Iterator
+
+TEXT_NS = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+SPAN_TAG = f"{TEXT_NS}span"
+PARAGRAPH_TAG = f"{TEXT_NS}p"
+STYLE_NS = "{urn:oasis:names:tc:opendocument:xmlns:style:1.0}"
+STYLE_TAG = f"{STYLE_NS}style"
+STYLE_NAME_ATTR = f"{STYLE_NS}name"
+STYLE_FAMILY_ATTR = f"{STYLE_NS}family"
+
+def _lxml(element: Element) -> etree._Element:
+    """Returns the lxml node behind an odfdo element, for bulk tree edits."""
+    return element._xml_element
+
+# =============================================================================
+# REFERENCE DOCUMENT CACHE
+# =============================================================================
+
+@lru_cache(maxsize=8)
+def _load_ref_doc(path: str) -> tuple[Document, dict[tuple[str, str], Style | None]]:
+    """
+    Parses a reference ODT once per run; the template never changes.
+    Returns it with a memo of the styles resolved from it, evicted together.
+    """
+    return Document(path), {}
+
+def _get_source_style(path: str, family: str, name: str) -> Style | None:
+    """Resolves a style from a cached reference document."""
+    ref_doc, resolved = _load_ref_doc(path)
+    if (family, name) not in resolved:
+        resolved[(family, name)] = ref_doc.get_style(family, name)
+    return resolved[(family, name)]
+
+# =============================================================================
+# REGEX HELPERS
+# =============================================================================
+
+_GLOB_MAGIC = re.compile(r"[*?[]")
+_QUANTIFIER = re.compile(r"\{\d*,?\d*\}")
+
+# Backreferences and conditional group references would point at the wrong
+# group once patterns are joined
+_BACKREF = re.compile(r"\\[1-9]|\(\?P=|\(\?\(\d")
+
+@lru_cache(maxsize=None)
+def _combine_patterns(patterns: tuple[re.Pattern, ...]) -> re.Pattern | None:
+    """Joins rule patterns into one alternation that matches if any rule does."""
+    if any(_BACKREF.search(p.pattern) for p in patterns):
+        return None
+    try:
+        return re.compile("|".join(f"(?:{p.pattern})" for p in patterns))
+    except re.error:
+        # e.g. the same group name used by two rules
+        return None
+
+def _skip_class(p: str, i: int) -> int:
+    """Returns the index just past the character class opening at p[i]."""
+    i += 1
+    if i < len(p) and p[i] == '^':
+        i += 1
+    if i < len(p) and p[i] == ']':
+        i += 1
+    while i < len(p) and p[i] != ']':
+        i += 2 if p[i] == '\\' else 1
+    return i + 1
+
+def _skip_comment(p: str, i: int) -> int:
+    """Returns the index just past the (?#...) comment opening at p[i]."""
+    return p.index(')', i) + 1
+
+def _skip_group(p: str, i: int) -> int:
+    """Returns the index just past the group opening at p[i]."""
+    depth = 0
+    while i < len(p):
+        c = p[i]
+        if c == '\\':
+            i += 2
+            continue
+        if p.startswith('(?#', i):
+            i = _skip_comment(p, i)
+            continue
+        if c == '[':
+            i = _skip_class(p, i)
+            continue
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+@lru_cache(maxsize=None)
+def _required_literal(pattern: re.Pattern) -> str:
+    """
+    Returns the longest run of plain characters every match of `pattern` must
+    contain, or '' when none can be told apart cheaply. Groups, classes and
+    escapes are skipped, so the result is a lower bound: never a false reject.
+    """
+    if pattern.flags & (re.IGNORECASE | re.VERBOSE):
+        return ''
+    p = pattern.pattern
+    runs, run = [], []
+    i = 0
+    while i < len(p):
+        c = p[i]
+        if p.startswith('(?#', i):
+            # Comments match nothing: a quantifier after one still applies to
+            # the character before it, so leave the current run open
+            i = _skip_comment(p, i)
+            continue
+        if c == '\\' and i + 1 < len(p) and not p[i + 1].isalnum():
+            run.append(p[i + 1])
+            i += 2
+            continue
+        if c in '*?' or (c == '{' and _QUANTIFIER.match(p, i)):
+            # The previous character is optional
+            if run:
+                run.pop()
+            runs.append(''.join(run))
+            run = []
+            i = _QUANTIFIER.match(p, i).end() if c == '{' else i + 1
+            continue
+        if c == '|':
+            # Top-level alternative: nothing is required by every match
+            return ''
+        if c in '\\[(.^$+':
+            runs.append(''.join(run))
+            run = []
+            if c == '\\':
+                # \d, \b, \x41, \N{...}: drop the whole escape
+                escape = p[i + 1] if i + 1 < len(p) else ''
+                i += 2
+                if escape == 'N' and i < len(p) and p[i] == '{':
+                    i = p.index('}', i) + 1
+                else:
+                    while i < len(p) and p[i].isalnum():
+                        i += 1
+            elif c == '[':
+                i = _skip_class(p, i)
+            elif c == '(':
+                i = _skip_group(p, i)
+            else:
+                i += 1
+            continue
+        run.append(c)
+        i += 1
+    runs.append(''.join(run))
+    return max(runs, key=len)
+
+class _RuleMatcher:
+    """
+    Decides which regex rules match a paragraph's text. Shared by RegexStyler
+    and FastAnalyzer, so a dry run tests exactly what the real run applies.
+    """
+    def __init__(self, rules: list[tuple[str, re.Pattern]]):
+        self.rules = rules  # (style_name, compiled pattern), in config order
+        # A paragraph no rule matches is rejected with a single scan
+        self._combined = _combine_patterns(tuple(p for _, p in rules)) if len(rules) > 1 else None
+        # ...or, cheaper still, when it lacks the text every rule requires
+        self._literals = [_required_literal(p) for _, p in rules]
+        self._all_literals = self._literals if all(self._literals) else None
+
+    def matching(self, text: str) -> Iterator[tuple[int, re.Match]]:
+        """Yields (rule index, match) for each rule matching `text`, in config order."""
+        if self._all_literals is not None and not any(lit in text for lit in self._all_literals):
+            return
+        if self._combined is not None and self._combined.search(text) is None:
+            return
+        for index, ((_, pattern), literal) in enumerate(zip(self.rules, self._literals)):
+            if literal not in text:
+                continue
+            match = pattern.search(text)
+            if match is not None:
+                yield index, match
 
 # =============================================================================
 # BASE ARCHITECTURE
@@ -12,8 +195,17 @@ from abc import ABC, abstractmethod
 
 class DocumentModifier(ABC):
     """Abstract Base Class for ODF modification strategies."""
-    def __init__(self, doc: Document):
+    def __init__(self, doc: Document, ctx: dict | None = None):
         self.doc = doc
+        # Per-document state shared by all modifiers applied to `doc`
+        self.ctx = ctx if ctx is not None else {}
+        self.changed = False  # set by apply() when the document was modified
+
+    def text_style_names(self) -> set[str]:
+        """Names of the document's text styles, collected once per document."""
+        if 'text_styles' not in self.ctx:
+            self.ctx['text_styles'] = {style.name for style in self.doc.get_styles(family='text')}
+        return self.ctx['text_styles']
 
     @abstractmethod
     def apply(self) -> list[tuple[str, str | int]]:
@@ -26,108 +218,288 @@ class DocumentModifier(ABC):
 
 class StyleImporter(DocumentModifier):
     """
-    Imports a style definition from a source ODT into the current document.
+    Imports style definitions from source ODTs into the current document.
     """
-    def __init__(self, doc: Document, style_name: str, family: str, source_file: str):
-        super().__init__(doc)
-        self.style_name = style_name
-        self.family = family  # 'paragraph' or 'text'
-        self.source_file = source_file
+    # Families stored in office:styles, merged there in a single pass
+    MERGED_FAMILIES = ('paragraph', 'text')
+
+    def __init__(self, doc: Document, rules: list[tuple[str, str, str]], ctx: dict | None = None):
+        super().__init__(doc, ctx)
+        self.rules = rules  # (style_name, family, source_file), in config order
 
     def apply(self) -> list:
-        """Extracts the style from reference and injects it into target."""
-        try:
-            ref_doc = Document(self.source_file)
-            source_style = ref_doc.get_style(self.family, self.style_name)
-            
-            if type(source_style) == Style:
-                self.doc.insert_style(source_style)
-                return [(f"Import {self.family} style: {self.style_name}", "Success")]
-            
-            return [(f"Import {self.family} style: {self.style_name}", "Not found in source")]
-        except Exception as e:
-            return [(f"Import {self.family} style: {self.style_name}", f"Error: {str(e)}")]
+        """Extracts the styles from their references and injects them into target."""
+        results = {}
+        pending = {}  # (family, style_name) -> label, for the office:styles merge
+        merged = {}   # (family, style_name) -> style copy
+        for style_name, family, source_file in self.rules:
+            label = f"Import {family} style: {style_name}"
+            try:
+                source_style = _get_source_style(source_file, family, style_name)
+                
+                if type(source_style) != Style:
+                    results[label] = "Not found in source"
+                elif family in self.MERGED_FAMILIES:
+                    # The cached element is shared across documents: insert a copy
+                    merged[(family, style_name)] = source_style.clone
+                    pending[(family, style_name)] = label
+                    results[label] = None  # keeps config order; set after the merge
+                else:
+                    self.doc.insert_style(source_style.clone)
+                    self._imported(family, style_name)
+                    results[label] = "Success"
+            except Exception as e:
+                results[label] = f"Error: {str(e)}"
+
+        if merged:
+            try:
+                self._merge_styles(merged)
+                for family, style_name in merged:
+                    self._imported(family, style_name)
+                status = "Success"
+            except Exception as e:
+                status = f"Error: {str(e)}"
+            for label in pending.values():
+                results[label] = status
+
+        return list(results.items())
+
+    def _merge_styles(self, styles: dict[tuple[str, str], Style]):
+        """Replaces or adds common styles with one pass over office:styles."""
+        container = _lxml(self.doc.styles.get_element("office:styles"))
+        existing = [
+            child for child in container.iterchildren(STYLE_TAG)
+            if (child.get(STYLE_FAMILY_ATTR), child.get(STYLE_NAME_ATTR)) in styles
+        ]
+        for child in existing:
+            container.remove(child)
+        container.extend(_lxml(style) for style in styles.values())
+
+    def _imported(self, family: str, style_name: str):
+        self.changed = True
+        if family == 'text' and 'text_styles' in self.ctx:
+            self.ctx['text_styles'].add(style_name)
 
 class RegexStyler(DocumentModifier):
     """
-    Applies an EXISTING style to text matching a regex pattern.
+    Applies EXISTING styles to text matching regex patterns.
     Does not create or define styles; only applies them by name.
     """
-    def __init__(self, doc: Document, style_name:str, regex: str):
-        super().__init__(doc)
-        self.style_name = style_name
-        self.regex = regex
+    def __init__(self, doc: Document, rules: list[tuple[str, re.Pattern]], ctx: dict | None = None):
+        super().__init__(doc, ctx)
+        self.rules = rules  # (style_name, compiled pattern), in config order
+        self._matcher = _RuleMatcher(rules)
 
     def apply(self) -> list:
         """Applies named styles to matching regex groups."""
         body = self.doc.body
-        match_count = 0
+        match_counts = {style_name: 0 for style_name, _ in self.rules}
+        # Check once per rule whether it names a text style
+        text_styles = self.text_style_names()
+        is_text_styles = [style_name in text_styles for style_name, _ in self.rules]
         
-        # Apply style to all matching paragraphs
-        for para in body.get_paragraphs(content=self.regex):
-            # Check whether a text style
-            if self.doc.get_style(family='text', name_or_element=self.style_name):
-                # Then use odfdo's set_span to appliy style_name to matching pattern
-                try:
-                    group1 = re.search(self.regex, para.text_recursive).group(1)
-                    self.regex = group1
-                except IndexError:
-                    pass
-                spans = para.set_span(self.style_name, regex=self.regex)
-                match_count += len(spans)
-            else:
-                # Else, format the whole paragraph 
-                # Clear paragraph styles
-                remove_tree(para, Span)
-                para.style = self.style_name
-                match_count += 1
+        # Walk the paragraphs once, testing every rule against each of them
+        for para in body.get_paragraphs():
+            for index, match in self._matcher.matching(para.text_recursive):
+                style_name, pattern = self.rules[index]
+                if is_text_styles[index]:
+                    # Then use odfdo's set_span to appliy style_name to matching pattern,
+                    # narrowed to the text of the first group when the pattern has one
+                    group1 = match.group(1) if pattern.groups else None
+                    span_regex = re.escape(group1) if group1 else pattern.pattern
+                    spans = para.set_span(style_name, regex=span_regex)
+                    match_counts[style_name] += len(spans)
+                else:
+                    # Else, format the whole paragraph 
+                    # Clear paragraph styles: unwrap every span, keeping its text,
+                    # in one lxml call instead of odfdo's Python-level remove_tree
+                    etree.strip_tags(_lxml(para), SPAN_TAG)
+                    para.style = style_name
+                    match_counts[style_name] += 1
                 
-        return [(f"Applied '{self.style_name}'", match_count)]
+        self.changed = any(match_counts.values())
+        return [(f"Applied '{style_name}'", count) for style_name, count in match_counts.items()]
+
+# =============================================================================
+# DRY-RUN ANALYSIS
+# =============================================================================
+
+class FastAnalyzer:
+    """
+    Counts paragraphs matching each regex rule by streaming content.xml.
+    Read-only: never builds the odfdo document tree.
+    """
+    def __init__(self, rules: list[tuple[str, re.Pattern]]):
+        self.rules = rules  # (style_name, compiled pattern), in config order
+        self._matcher = _RuleMatcher(rules)
+
+    def analyze(self, file_path: str) -> list:
+        """Returns the number of matching paragraphs per rule."""
+        match_counts = {style_name: 0 for style_name, _ in self.rules}
+        with zipfile.ZipFile(file_path) as package, package.open('content.xml') as stream:
+            for _, para in etree.iterparse(stream, events=('end',), tag=PARAGRAPH_TAG):
+                # Same text as the real run: odfdo expands tabs, spaces and line breaks
+                text = Element.from_tag(para).text_recursive
+                for index, _ in self._matcher.matching(text):
+                    match_counts[self.rules[index][0]] += 1
+                # Free parsed paragraphs, unless an enclosing paragraph still needs its text
+                if next(para.iterancestors(PARAGRAPH_TAG), None) is None:
+                    para.clear()
+                    while para.getprevious() is not None:
+                        del para.getparent()[0]
+
+        return [(f"Paragraphs matching '{style_name}'", count) for style_name, count in match_counts.items()]
 
 # =============================================================================
 # PROCESSOR ENGINE
 # =============================================================================
 
+def _analyze_one(file_path: str, analyzers: tuple) -> tuple[str, list]:
+    """Counts rule hits in a single file for a dry run. Runs inside pool workers."""
+    logs = []
+    for analyzer in analyzers:
+        logs.extend(analyzer.analyze(file_path))
+    return f"[DRY RUN] Would process: {Path(file_path).name}", logs
+
+def _process_one(file_path: str, pipeline: tuple, output_suffix: str) -> tuple[str, list]:
+    """
+    Loads, modifies and saves a single file. Runs inside pool workers.
+    Returns a progress line and the modifier logs, printed by the parent.
+    """
+    path = Path(file_path)
+    output_path = path.parent / f"{path.stem}{output_suffix}{path.suffix}"
+    
+    doc = Document(file_path)
+    
+    logs = []
+    ctx = {}
+    dirty = False
+    for make_modifier in pipeline:
+        modifier = make_modifier(doc, ctx=ctx)
+        logs.extend(modifier.apply())
+        dirty = dirty or modifier.changed
+    
+    if dirty:
+        doc.save(str(output_path))
+    elif output_path.resolve() != path.resolve():
+        # Nothing was modified: copy the original bytes instead of re-zipping
+        # (with an empty suffix the unchanged input already is the output)
+        shutil.copyfile(file_path, output_path)
+
+    return f"\nProcessing: {path.name}", logs
+
+def _find_files(file_pattern: str) -> list[str]:
+    """
+    Expands the file glob. A plain '<dir>/*<suffix>' pattern (the usual '*.odt')
+    is served by a single directory scan instead of fnmatch on every entry.
+    """
+    dirname, basename = os.path.split(file_pattern)
+    suffix = basename[1:]
+    if not (basename.startswith('*') and suffix and not _GLOB_MAGIC.search(dirname + suffix)):
+        return list(glob.iglob(file_pattern))
+
+    suffix = os.path.normcase(suffix)
+    try:
+        with os.scandir(dirname or os.curdir) as entries:
+            return [
+                os.path.join(dirname, entry.name) for entry in entries
+                # Like glob, leave out hidden files
+                if not entry.name.startswith('.')
+                and os.path.normcase(entry.name).endswith(suffix)
+                and entry.is_file()
+            ]
+    except OSError:
+        return []
+
 class BatchProcessor:
     """Manages the batch modification of multiple ODF files."""
-    def __init__(self, file_pattern: str, dry_run: bool = False):
-        self.files = glob.glob(file_pattern)
+    # Workers are replaced after this many files, dropping their caches and
+    # any memory held on to by large documents
+    MAX_FILES_PER_WORKER = 64
+    # Progress lines are printed once per this many finished files
+    PROGRESS_BATCH = 10
+
+    def __init__(self, file_pattern: str, dry_run: bool = False, workers: int = 1):
+        self.files = _find_files(file_pattern)
         self.dry_run = dry_run
+        self.workers = max(1, workers)
         self.modifier_configs = []
-        self.totals = {}
+        self.totals = collections.Counter()
 
     def add_modifier_config(self, modifier_class: type, **kwargs):
         self.modifier_configs.append((modifier_class, kwargs))
 
+    def build_pipeline(self) -> tuple:
+        """Binds every modifier class to its config; the result only needs a document."""
+        return tuple(partial(mod_class, **kwargs) for mod_class, kwargs in self.modifier_configs)
+
     def run(self, output_suffix: str = "_EDITED"):
         if not self.files:
             print("No files matched the pattern.")
             return
 
-        for file_path in self.files:
-            path = Path(file_path)
-            output_path = path.parent / f"{path.stem}{output_suffix}{path.suffix}"
-            
-            if self.dry_run:
-                print(f"[DRY RUN] Would process: {path.name}")
+        if self.dry_run:
+            # Style imports do not depend on the target: check the sources once
+            for mod_class, kwargs in self.modifier_configs:
+                if mod_class is not StyleImporter:
+                    continue
+                for style_name, family, source_file in kwargs['rules']:
+                    label = f"Import {family} style: {style_name}"
+                    try:
+                        found = type(_get_source_style(source_file, family, style_name)) == Style
+                        self.totals[label] = "Would import" if found else "Not found in source"
+                    except Exception as e:
+                        self.totals[label] = f"Error: {str(e)}"
 
-            doc = Document(file_path)
-            print(f"\nProcessing: {path.name}")
-            
+            # Nothing is modified: stream each file instead of loading a Document
+            analyzers = tuple(
+                FastAnalyzer(kwargs['rules'])
+                for mod_class, kwargs in self.modifier_configs if mod_class is RegexStyler
+            )
+            task = partial(_analyze_one, analyzers=analyzers)
+        else:
+            # Resolve reference styles once, before touching any target file
+            # (forked workers inherit the warm cache)
             for mod_class, kwargs in self.modifier_configs:
-                modifier = mod_class(doc, **kwargs)
-                logs = modifier.apply()
-                for label, info in logs:
-                    # print(f"  {label} -> {info}")
-                    if isinstance(info, int):
-                        self.totals[label] = self.totals.get(label, 0) + info
-                    else:
-                        self.totals[label] = info
-            
-            if not self.dry_run:
-                doc.save(str(output_path))
-
-            self._print_summary()
+                if mod_class is not StyleImporter:
+                    continue
+                for style_name, family, source_file in kwargs['rules']:
+                    try:
+                        _get_source_style(source_file, family, style_name)
+                    except Exception:
+                        # Reported per file by StyleImporter.apply
+                        pass
+
+            task = partial(_process_one, pipeline=self.build_pipeline(), output_suffix=output_suffix)
+
+        # Files are independent: process them concurrently, collecting results
+        # as they arrive but in input order, so output and statuses are stable
+        workers = min(self.workers, len(self.files))
+        if workers > 1:
+            with multiprocessing.Pool(workers, maxtasksperchild=self.MAX_FILES_PER_WORKER) as pool:
+                self._collect(pool.imap(task, self.files))
+        else:
+            self._collect(map(task, self.files))
+
+        self._print_summary()
+
+    def _collect(self, results):
+        """Aggregates per-file logs as they arrive, printing progress in batches."""
+        lines = []
+        for line, logs in results:
+            lines.append(line)
+            # One write per batch of files rather than a flush per file
+            if len(lines) >= self.PROGRESS_BATCH:
+                print("\n".join(lines), flush=True)
+                lines.clear()
+            for label, info in logs:
+                # print(f"  {label} -> {info}")
+                if isinstance(info, int):
+                    self.totals[label] += info
+                else:
+                    self.totals[label] = info
+        if lines:
+            print("\n".join(lines))
 
     def _print_summary(self):
         print("\n" + "="*65)
@@ -147,6 +519,8 @@ def main():
     parser.add_argument("--config", default="rules.json", help="Path to JSON config")
     parser.add_argument("--dry-run", action="store_true")
     parser.add_argument("--suffix", default="_EDITED")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) - 1),
+                        help="Number of files processed in parallel")
     
     args = parser.parse_args()
 
@@ -157,24 +531,19 @@ def main():
         print(f"Error: Could not load {args.config} ({e})")
         return
 
-    processor = BatchProcessor(args.pattern, dry_run=args.dry_run)
+    processor = BatchProcessor(args.pattern, dry_run=args.dry_run, workers=args.workers)
 
     for mod in config_data.get('modifications', []):
         if mod['type'] == 'import_style':
-            for rule in mod['rules']:
-                processor.add_modifier_config(
-                    StyleImporter, 
-                    style_name=rule['style_name'], 
-                    family=rule['family'],
-                    source_file=rule['source_file']
-                )
+            processor.add_modifier_config(
+                StyleImporter,
+                rules=[(rule['style_name'], rule['family'], rule['source_file']) for rule in mod['rules']]
+            )
         elif mod['type'] == 'regex_span_styler':
-            for rule in mod['rules']:
-                processor.add_modifier_config(
-                    RegexStyler, 
-                    style_name=rule['style_name'],
-                    regex=rule['pattern']
-                )
+            processor.add_modifier_config(
+                RegexStyler,
+                rules=[(rule['style_name'], re.compile(rule['pattern'])) for rule in mod['rules']]
+            )
 
     processor.run(output_suffix=args.suffix)
 
@@ -0,0 +1,62 @@
+import random
+import re
+import unittest
+import warnings
+
+from styler import _required_literal
+
+
+class RequiredLiteralTest(unittest.TestCase):
+    """_required_literal() must never reject text its pattern matches."""
+
+    def assertNeverRejects(self, pattern: re.Pattern, text: str):
+        if pattern.search(text) is not None:
+            literal = _required_literal(pattern)
+            self.assertIn(literal, text, f"{pattern.pattern!r} matches {text!r}")
+
+    def test_examples(self):
+        cases = {
+            r"\+IMPORTANT: (.*)": "+IMPORTANT: ",
+            "BIG warning": "BIG warning",
+            "colou?r": "colo",
+            r"\d{3}xyz": "xyz",
+            r"\N{EM DASH}abc": "abc",
+            "a|b": "",
+            "(?i)abc": "",
+            "ab(?#opt)?c": "a",
+            "TODO(?#colon)?:": "TOD",
+            "(a(?#x(y)b)cd": "cd",
+        }
+        for source, literal in cases.items():
+            with self.subTest(pattern=source):
+                self.assertEqual(_required_literal(re.compile(source)), literal)
+
+    def test_comments_do_not_hide_quantifiers(self):
+        self.assertNeverRejects(re.compile("ab(?#opt)?c"), "ac")
+        self.assertNeverRejects(re.compile("TODO(?#colon)?:"), "TOD:")
+
+    def test_random_patterns(self):
+        # Property: pattern matches text => required literal is in text
+        rng = random.Random(20261015)
+        tokens = ["a", "b", "a", "b", "|", "*", "+", "?", "(", ")", "[", "]",
+                  "{2}", "{,1}", "\\", ".", "^", "$", "(?#x)", "(?#)", "(?:", "\\d"]
+        chars = "aab[]{}().,2"
+        checked = 0
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for _ in range(20000):
+                source = "".join(rng.choice(tokens) for _ in range(rng.randint(1, 8)))
+                try:
+                    pattern = re.compile(source)
+                except re.error:
+                    continue
+                for _ in range(6):
+                    text = "".join(rng.choice(chars) for _ in range(rng.randint(0, 10)))
+                    with self.subTest(pattern=source, text=text):
+                        self.assertNeverRejects(pattern, text)
+                    checked += 1
+        self.assertGreater(checked, 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()